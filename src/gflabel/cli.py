@@ -14,7 +14,6 @@ from typing import Any, Sequence
 import build123d as bd
 import pint
 import rich
-import rich.table
 
 # from build123d import *
 from build123d import (
@@ -43,7 +42,7 @@ from .bases.modern import ModernBase
 from .bases.none import NoneBase
 from .bases.plain import PlainBase
 from .bases.pred import PredBase, PredBoxBase
-from .label import render_divided_label
+from .label import LabelRenderer, render_divided_label
 from .options import LabelStyle, RenderOptions
 from .util import IndentingRichHandler, batched, unit_registry
 
@@ -62,6 +61,9 @@ class ListFragmentsAction(argparse.Action):
         super().__init__(option_strings, dest, nargs=0, **kwargs)
 
     def __call__(self, parser, namespace, values, option_string=None):
+        # Only needed for listing, so don't import unless requested
+        import rich.table
+
         table = rich.table.Table("NAMES", "DESCRIPTION")
 
         frags = fragments.fragment_description_table()
@@ -89,6 +91,8 @@ class ListSymbolsAction(argparse.Action):
         values: str | Sequence[Any] | None,
         option_string: str | None = None,
     ) -> None:
+        import rich.table
+
         manifest = fragments.electronic_symbols_manifest()
         cols = ["ID", "Category", "Name", "Standard", "Filename"]
         table = rich.table.Table(*cols)
@@ -308,7 +312,7 @@ def run(argv: list[str] | None = None):
     logging.getLogger("websockets").setLevel(logging.WARNING)
     logging.getLogger("build123d").setLevel(logging.WARNING)
 
-    logger.debug(f"Args: {args}")
+    logger.debug("Args: %s", args)
 
     base_type = base_name_to_subclass(args.base)
 
@@ -346,7 +350,7 @@ def run(argv: list[str] | None = None):
     elif args.margin is not pint.Quantity:
         args.margin = pint.Quantity(args.margin, unit_registry.mm)
 
-    logger.info(f"Rendering label with width: {args.width}")
+    logger.info("Rendering label with width: %s", args.width)
 
     args.divisions = args.divisions or len(args.labels)
     args.labels = [x.replace("\\n", "\n") for x in args.labels]
@@ -374,6 +378,8 @@ def run(argv: list[str] | None = None):
         body_locations = []
         with BuildSketch(mode=Mode.PRIVATE) as label_sketch:
             all_labels = []
+            # Share rendered fragments between all of the labels
+            renderer = LabelRenderer(options)
             for labels in batched(args.labels, args.divisions):
                 body_locations.append((0, y))
                 try:
@@ -383,6 +389,7 @@ def run(argv: list[str] | None = None):
                             label_area,
                             divisions=args.divisions,
                             options=options,
+                            renderer=renderer,
                         ).locate(Location([0, y]))
                     )
                 except fragments.InvalidFragmentSpecification as e:
@@ -407,7 +414,7 @@ def run(argv: list[str] | None = None):
 
             logger.debug("Extruding labels")
             is_embossed = args.style == LabelStyle.EMBOSSED
-            extrude(
+            label_volume = extrude(
                 label_sketch.sketch,
                 amount=args.depth if is_embossed else -args.depth,
                 mode=(Mode.ADD if is_embossed else Mode.SUBTRACT),
@@ -417,8 +424,11 @@ def run(argv: list[str] | None = None):
         part.part.label = "Base"
 
     if args.style == LabelStyle.EMBEDDED:
-        # We want to make new volumes for the label, making it flush
-        embedded_label = extrude(label_sketch.sketch, amount=-args.depth)
+        # We want to make new volumes for the label, making it flush. This
+        # is exactly the volume that was cut from the bases, if we made them.
+        embedded_label = (
+            extrude(label_sketch.sketch, amount=-args.depth) if is_2d else label_volume
+        )
         embedded_label.label = "Label"
         assembly = Compound([part.part, embedded_label])
     else:
@@ -426,10 +436,10 @@ def run(argv: list[str] | None = None):
 
     for output in args.output:
         if output.endswith(".stl"):
-            logger.info(f"Writing STL {output}")
+            logger.info("Writing STL %s", output)
             bd.export_stl(assembly, output)
         elif output.endswith(".step"):
-            logger.info(f"Writing STEP {output}")
+            logger.info("Writing STEP %s", output)
             export_step(assembly, output)
         elif output.endswith(".svg"):
             max_dimension = max(
@@ -441,7 +451,7 @@ def run(argv: list[str] | None = None):
             if args.box and is_2d:
                 exporter.add_layer("Box", line_weight=1)
                 exporter.add_shape(body_box.sketch, layer="Box")
-            logger.info(f"Writing SVG {output}")
+            logger.info("Writing SVG %s", output)
             exporter.add_shape(label_sketch.sketch, layer="Shapes")
             exporter.write(output)
         else:
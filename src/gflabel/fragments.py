@@ -82,7 +82,14 @@ class InvalidFragmentSpecification(RuntimeError):
     pass
 
 
+@functools.lru_cache(maxsize=2048)
 def fragment_from_spec(spec: str) -> Fragment:
+    """
+    Create a fragment instance from the contents of a {} fragment spec.
+
+    Fragment instances may be shared between identical specs, so must not
+    be mutated after construction.
+    """
     # If the fragment is just a number, this is distance to space out
     try:
         value = float(spec)
@@ -97,9 +104,10 @@ def fragment_from_spec(spec: str) -> Fragment:
     name, args = match.groups()
     args = [x.strip() for x in args.split(",")] if args else []
 
-    if name not in FRAGMENTS:
+    factory = FRAGMENTS.get(name)
+    if factory is None:
         raise RuntimeError(f"Unknown fragment class: {name}")
-    return FRAGMENTS[name](*args)
+    return factory(*args)
 
 
 def fragment(*names: str, examples: list[str] = [], overheight: float | None = None):
@@ -109,7 +117,7 @@ def fragment(*names: str, examples: list[str] = [], overheight: float | None = N
         fn: Type[Fragment] | Callable[[float, float], Sketch],
     ) -> Type[Fragment] | Callable[[float, float], Sketch]:
         if not isinstance(fn, type) and callable(fn):
-            logger.debug(f"Wrapping fragment function {fn}")
+            logger.debug("Wrapping fragment function %s", fn)
 
             # We can have callable functions
             # class FnWrapper(Fragment):
@@ -131,7 +139,7 @@ def fragment(*names: str, examples: list[str] = [], overheight: float | None = N
             fragment = fn
         # Now assign this in the name dict
         for name in names:
-            logger.debug(f"Registering fragment {name}")
+            logger.debug("Registering fragment %s", name)
             FRAGMENTS[name] = fragment
         return fn
 
@@ -139,6 +147,13 @@ def fragment(*names: str, examples: list[str] = [], overheight: float | None = N
 
 
 class Fragment(metaclass=ABCMeta):
+    """
+    A piece of a label line that can be rendered to a sketch.
+
+    Instances may be shared between identical specs (see fragment_from_spec),
+    so should be treated as immutable once constructed.
+    """
+
     # Is this a fixed or variable-width fragment?
     variable_width = False
 
@@ -197,9 +212,7 @@ class SpacerFragment(Fragment):
         self.distance = distance
 
     def render(self, height: float, maxsize: float, options: RenderOptions) -> Sketch:
-        with BuildSketch() as sketch:
-            Rectangle(self.distance, height)
-        return sketch.sketch
+        return Rectangle(self.distance, height, mode=Mode.PRIVATE)
 
 
 @fragment("...")
@@ -218,9 +231,7 @@ class ExpandingFragment(Fragment):
     examples = ["L{...}R"]
 
     def render(self, height: float, maxsize: float, options: RenderOptions) -> Sketch:
-        with BuildSketch() as sketch:
-            Rectangle(maxsize, height)
-        return sketch.sketch
+        return Rectangle(maxsize, height, mode=Mode.PRIVATE)
 
     def min_width(self, height: float) -> float:
         return 0
@@ -235,7 +246,7 @@ class TextFragment(Fragment):
             raise ValueError("Trying to render zero-height text fragment")
         with BuildSketch() as sketch:
             with options.font.font_options() as f:
-                print(f"Using {f}")
+                logger.debug("Using font options %s", f)
                 Text(self.text, font_size=options.font.get_allowed_height(height), **f)
         return sketch.sketch
 
@@ -278,9 +289,11 @@ class WhitespaceFragment(Fragment):
         self.whitespace = whitespace
 
     def render(self, height: float, maxsize: float, options: RenderOptions) -> Sketch:
-        with BuildSketch() as sketch:
-            Rectangle(_whitespace_width(self.whitespace, height, options), height)
-        return sketch.sketch
+        return Rectangle(
+            _whitespace_width(self.whitespace, height, options),
+            height,
+            mode=Mode.PRIVATE,
+        )
 
 
 @fragment("hexhead", examples=["{hexhead}"])
@@ -353,10 +366,9 @@ def _fragment_insert(height: float, _maxsize: float) -> Sketch:
 @fragment("hexnut", "nut", examples=["{nut}"])
 def _fragment_hexnut(height: float, _maxsize: float) -> Sketch:
     """Hexagonal outer profile nut with circular cutout."""
-    with BuildSketch(mode=Mode.PRIVATE) as sketch:
-        RegularPolygon(height / 2, side_count=6)
-        Circle(height / 2 * 0.4, mode=Mode.SUBTRACT)
-    return sketch.sketch
+    return RegularPolygon(height / 2, side_count=6, mode=Mode.PRIVATE) - Circle(
+        height / 2 * 0.4, mode=Mode.PRIVATE
+    )
 
 
 @fragment("nut_profile", examples=["{nut_profile}"])
@@ -424,11 +436,10 @@ def _fragment_locknut_profile(height: float, _maxsize: float | None = None) -> S
 @fragment("washer", examples=["{washer}"])
 def _fragment_washer(height: float, _maxsize: float) -> Sketch:
     """Circular washer with a circular hole."""
-    with BuildSketch(mode=Mode.PRIVATE) as sketch:
-        inner_radius = 0.55
-        Circle(height / 2)
-        Circle(height / 2 * inner_radius, mode=Mode.SUBTRACT)
-    return sketch.sketch
+    inner_radius = 0.55
+    return Circle(height / 2, mode=Mode.PRIVATE) - Circle(
+        height / 2 * inner_radius, mode=Mode.PRIVATE
+    )
 
 
 @fragment("lockwasher", examples=["{lockwasher}"])
@@ -451,9 +462,7 @@ def _fragment_lockwasher(height: float, _maxsize: float) -> Sketch:
 @fragment("circle", examples=["{circle}"])
 def _fragment_circle(height: float, _maxsize: float) -> Sketch:
     """A filled circle."""
-    with BuildSketch(mode=Mode.PRIVATE) as sketch:
-        Circle(height / 2)
-    return sketch.sketch
+    return Circle(height / 2, mode=Mode.PRIVATE)
 
 
 class BoltBase(Fragment):
@@ -544,9 +553,13 @@ class BoltFragment(BoltBase):
 
         # Work out what the bottom of the bolt looks like
         if "tapping" in self.modifiers:
-            bolt_bottom = [(hw - lw / 2, lw / 2), (hw, 0), (hw - lw / 2, -lw / 2)]
+            bolt_bottom: tuple[tuple[float, float], ...] = (
+                (hw - lw / 2, lw / 2),
+                (hw, 0),
+                (hw - lw / 2, -lw / 2),
+            )
         else:
-            bolt_bottom = [(hw, lw / 2), (hw, -lw / 2)]
+            bolt_bottom = ((hw, lw / 2), (hw, -lw / 2))
 
         # Whether the bolt is split or not, we always need a head part
         with BuildSketch(mode=Mode.PRIVATE) as sketch:
@@ -580,12 +593,12 @@ class BoltFragment(BoltBase):
                         Line([head_connector_bottom, _bottom_arc @ 1])
                 elif self.headshape == "socket":
                     _head = Polyline(
-                        [
+                        (
                             (-hw + lw, -head_h),
                             (-hw, -head_h),
                             (-hw, head_h),
                             (-hw + lw, head_h),
-                        ]
+                        )
                     )
                     head_connector_bottom = _head @ 0
                     head_connector_top = _head @ 1
@@ -603,19 +616,19 @@ class BoltFragment(BoltBase):
                 if not split_bolt:
                     # This line continuously covers the whole bolt
                     Polyline(
-                        [
+                        (
                             head_connector_top,
                             (-hw + lw, lw / 2),
                             *bolt_bottom,
                             (-hw + lw, -lw / 2),
                             head_connector_bottom,
-                        ],
+                        ),
                     )
                 else:
                     # We have the divider attached to the head to make
                     x_shaft_midpoint = lw + (maxsize - lw) / 2 - hw
                     Polyline(
-                        [
+                        (
                             head_connector_top,
                             (-hw + lw, lw / 2),
                             # Divider is halfway along the shaft
@@ -623,7 +636,7 @@ class BoltFragment(BoltBase):
                             (x_shaft_midpoint - lw / 2 - half_split, -lw / 2),
                             (-hw + lw, -lw / 2),
                             head_connector_bottom,
-                        ],
+                        ),
                     )
 
             make_face()
@@ -632,12 +645,12 @@ class BoltFragment(BoltBase):
             if split_bolt:
                 with BuildLine() as _line:
                     Polyline(
-                        [
+                        (
                             # Divider is halfway along the shaft
                             (x_shaft_midpoint + lw / 2 + half_split, lw / 2),
                             *bolt_bottom,
                             (x_shaft_midpoint - lw / 2 + half_split, -lw / 2),
-                        ],
+                        ),
                         close=True,
                     )
                 make_face()
@@ -936,9 +949,7 @@ def _box_fragment(
     """Arbitrary width, height centered box. If height is not specified, will expand to row height."""
     width = float(in_width)
     height = float(in_height) if in_height else height
-    with BuildSketch() as sketch:
-        Rectangle(width, height)
-    return sketch.sketch
+    return Rectangle(width, height, mode=Mode.PRIVATE)
 
 
 class FragmentDescriptionRow(NamedTuple):
@@ -1090,7 +1101,7 @@ def _match_electronic_symbol_with_selectors(selectors: Iterable[str]) -> Manifes
         logger.debug("No exact matches, using fuzzy matches instead")
         # Split the request into a pool of matching tokens
         match_tokens = set(itertools.chain(*[x.split() for x in requested]))
-        logger.debug(f"Using match soup: {match_tokens!r}")
+        logger.debug("Using match soup: %r", match_tokens)
         for symbol in manifest:
             # Create a soup for this symbol
             soup = set(
@@ -1105,7 +1116,7 @@ def _match_electronic_symbol_with_selectors(selectors: Iterable[str]) -> Manifes
                 soup.add("gate")
             # Use this symbol if all of our tokens are in any of the soup
             if all(any(cand in s for s in soup) for cand in match_tokens):
-                logger.debug(f"    {symbol['id']} was a complete match!")
+                logger.debug("    %s was a complete match!", symbol["id"])
                 matches.append(symbol)
 
     if len(matches) == 1:
@@ -1118,19 +1129,22 @@ def _match_electronic_symbol_with_selectors(selectors: Iterable[str]) -> Manifes
         )
 
     # We have multiple matches. Try
-    logger.debug(f"Got {len(matches)} matches. Attempting to refine.")
+    logger.debug("Got %d matches. Attempting to refine.", len(matches))
 
     if len({x["category"] for x in matches}) == 1:
         matches = _match_electronic_symbol_from_standard(standards_order, matches)
         if len(matches) == 1:
             logger.debug(
-                f"Using symbol \"{matches[0]['id']}\" because standard [b]{matches[0]['standard']}[/b] is preferred.",
+                'Using symbol "%s" because standard [b]%s[/b] is preferred.',
+                matches[0]["id"],
+                matches[0]["standard"],
                 extra={"markup": True},
             )
             return matches[0]
         else:
             logger.debug(
-                f"Preferred standard was not enough to discriminate, {len(matches)} equivalent matches"
+                "Preferred standard was not enough to discriminate, %d equivalent matches",
+                len(matches),
             )
     if matches:
         cols = ["ID", "Category", "Name", "Standard", "Filename"]
@@ -1272,18 +1286,17 @@ if __name__ == "__main__":
     print(f"| {'Names':{maxname}} | {'Description':{desc_len}} |")
     print("|" + "-" * (maxname + 2) + "|" + "-" * (desc_len + 2) + "|")
 
-    for frag in frags:
+    # Escape for use inside a markdown table cell
+    markdown_escapes = str.maketrans(
+        {"<": "&lt;", ">": "&gt;", "\n": "<br>", "|": "\\|"}
+    )
 
-        def _clean(s):
-            if s is None:
-                return ""
-            return (
-                s.replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace("\n", "<br>")
-                .replace("|", "\\|")
-            )
+    def _clean(s):
+        if s is None:
+            return ""
+        return s.translate(markdown_escapes)
 
+    for frag in frags:
         if frag.names == ["|"]:
             frag = frag._replace(names=["`|` (pipe)"])
         desc = _clean(frag.description)
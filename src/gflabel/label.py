@@ -4,8 +4,11 @@ Code for rendering a label from a label definition.
 
 from __future__ import annotations
 
+import functools
 import logging
 import re
+from collections import OrderedDict
+from typing import Iterator
 
 from build123d import (
     BuildSketch,
@@ -16,46 +19,130 @@ from build123d import (
     Vector,
     add,
 )
-from rich import print
 
 from . import fragments
 from .options import RenderOptions
-from .util import IndentingRichHandler, batched
+from .util import IndentingRichHandler
 
 logger = logging.getLogger(__name__)
 
-RE_FRAGMENT = re.compile(r"((?<!{){[^{}]+})")
+_SPLIT_RE = fragments.SplitterFragment.SPLIT_RE
+# Non-blank lines that don't contain any fragment that fills the line width
+_RE_UNALIGNED_LINE = re.compile(
+    r"^(?!.*\{\.\.\.\})(?!.*\{measure\})(.+)$", re.MULTILINE
+)
+_ALIGNMENT_PREFIXES = frozenset(("{<}", "{>}"))
+# Maximum number of rendered fragments kept by each LabelRenderer
+_RENDER_CACHE_SIZE = 1024
 
 
-def _spec_to_fragments(spec: str) -> list[fragments.Fragment]:
-    """Convert a single line spec string to a list of renderable fragments."""
-    fragment_list = []
-    for part in RE_FRAGMENT.split(spec):
-        if part.startswith("{") and not part.startswith("{{") and part.endswith("}"):
-            # We have a special fragment. Find and instantiate it.
-            fragment_list.append(fragments.fragment_from_spec(part[1:-1]))
-        else:
-            # We have text. Build123d Text object doesn't handle leading/
-            # trailing spaces, so let's split them out here and put in
-            # explicit whitespace fragments
-            part = part.replace("{{", "{").replace("}}", "}")
-            left_spaces = part[: len(part) - len(part.lstrip())]
-            if left_spaces:
-                fragment_list.append(fragments.WhitespaceFragment(left_spaces))
-            part = part.lstrip()
+def _split_columns(spec: str) -> Iterator[tuple[str, tuple[str, ...] | None]]:
+    """
+    Split a label spec into columns.
 
-            part_stripped = part.strip()
-            if part_stripped:
-                fragment_list.append(fragments.TextFragment(part_stripped))
+    Yields:
+        The spec for each column, along with the matched groups of the
+        divider that follows it. The last column has no divider (None).
+    """
+    # Most labels only have one column, so don't bother scanning for them
+    if "|" not in spec:
+        yield spec, None
+        return
+    last_end = 0
+    for match in _SPLIT_RE.finditer(spec):
+        yield spec[last_end : match.start()], match.groups()
+        last_end = match.end()
+    yield spec[last_end:], None
+
+
+def _handle_spec_alignment(scoped_spec: str) -> tuple[str, str | None]:
+    """Handle alignment fragment at start of a label."""
+    # Special handling: First column alignment is at start of string
+    if scoped_spec[:3] in _ALIGNMENT_PREFIXES:
+        return scoped_spec[3:], scoped_spec[1]
+    else:
+        return scoped_spec, None
+
+
+# Text and whitespace fragments are interned, so that identical text
+# shares a fragment instance (and so rendered sketches) across lines
+@functools.lru_cache(maxsize=1024)
+def _text_fragment(text: str) -> fragments.TextFragment:
+    return fragments.TextFragment(text)
+
+
+@functools.lru_cache(maxsize=1024)
+def _whitespace_fragment(whitespace: str) -> fragments.WhitespaceFragment:
+    return fragments.WhitespaceFragment(whitespace)
+
+
+# Column dividers are usually repeated across a whole sheet of labels
+@functools.lru_cache(maxsize=128)
+def _splitter_fragment(*divider: str | None) -> fragments.SplitterFragment:
+    return fragments.SplitterFragment(*divider)
+
+
+def _text_to_fragments(text: str, fragment_list: list[fragments.Fragment]) -> None:
+    """Convert a run of plain label text to fragments, appending to a list."""
+    if "{{" in text or "}}" in text:
+        text = text.replace("{{", "{").replace("}}", "}")
+    # Build123d Text object doesn't handle leading/trailing spaces, so
+    # let's split them out here and put in explicit whitespace fragments
+    if left_chars := len(text) - len(text.lstrip()):
+        fragment_list.append(_whitespace_fragment(text[:left_chars]))
+    if stripped := text.strip():
+        fragment_list.append(_text_fragment(stripped))
+        if right_chars := len(text) - len(text.rstrip()):
+            fragment_list.append(_whitespace_fragment(text[-right_chars:]))
+
+
+@functools.lru_cache(maxsize=1024)
+def _spec_to_fragments(spec: str) -> tuple[fragments.Fragment, ...]:
+    """
+    Convert a single line spec string to a sequence of renderable fragments.
 
-            if chars := len(part) - len(part_stripped):
-                fragment_list.append(fragments.WhitespaceFragment(part[-chars:]))
-    return fragment_list
+    The result is cached, so is returned as an immutable tuple.
+    """
+    fragment_list: list[fragments.Fragment] = []
+    # Scan through the spec for {fragment} definitions; these are a run of
+    # non-brace characters enclosed in braces, where the opening brace is
+    # not itself preceded by a brace (which would make it an escape)
+    text_start = 0
+    i = spec.find("{")
+    while i != -1:
+        if i and spec[i - 1] == "{":
+            i = spec.find("{", i + 1)
+            continue
+        close = spec.find("}", i + 1)
+        if close > i + 1 and spec.find("{", i + 1, close) == -1:
+            # We have a special fragment. Find and instantiate it.
+            _text_to_fragments(spec[text_start:i], fragment_list)
+            fragment_list.append(fragments.fragment_from_spec(spec[i + 1 : close]))
+            text_start = close + 1
+            i = spec.find("{", text_start)
+        else:
+            i = spec.find("{", i + 1)
+    _text_to_fragments(spec[text_start:], fragment_list)
+    return tuple(fragment_list)
 
 
 class LabelRenderer:
     def __init__(self, options: RenderOptions):
         self.opts = options
+        # Rendered fragment sketches and their widths, keyed on the render
+        # arguments. The same fragment instances are shared between
+        # identical lines, so this avoids re-rendering across columns and
+        # repeated labels. Least-recently used entries are dropped once
+        # this holds _RENDER_CACHE_SIZE entries.
+        self._render_cache: OrderedDict[
+            tuple[fragments.Fragment, float, float, RenderOptions],
+            tuple[Sketch, float],
+        ] = OrderedDict()
+        # Options for each overheight setting, so that lines do not need to
+        # build a new options tuple every time they are laid out
+        self._line_options = {
+            allow: options._replace(allow_overheight=allow) for allow in (False, True)
+        }
 
     def render(self, spec: str, area: Vector) -> Sketch:
         """
@@ -70,28 +157,15 @@ class LabelRenderer:
             the origin.
         """
         # Area splitting
-        SPLIT_RE = fragments.SplitterFragment.SPLIT_RE
         columns = []
         column_proportions: list[float] = []
 
-        def _handle_spec_alignment(scoped_spec) -> tuple[str, str | None]:
-            """Handle alignment fragment at start of a label."""
-            # Special handling: First column alignment is at start of string
-            if scoped_spec[:3] in {"{<}", "{>}"}:
-                return scoped_spec[3:], scoped_spec[1]
-            else:
-                return scoped_spec, None
-
-        # spec, first_alignment = _handle_spec_alignment(spec)
-
-        for label, *divider in batched(
-            fragments.SplitterFragment.SPLIT_RE.split(spec), SPLIT_RE.groups + 1
-        ):
+        for label, divider in _split_columns(spec):
             label, alignment = _handle_spec_alignment(label)
 
             # The last round of this loop will not have any divider
-            if divider:
-                split = fragments.SplitterFragment(*divider)
+            if divider is not None:
+                split = _splitter_fragment(*divider)
                 if not column_proportions:
                     # We're the first divider, define both
                     column_proportions = [split.left, split.right]
@@ -104,224 +178,298 @@ class LabelRenderer:
             # If we've specified an alignment, pre-process to add alignment
             # fragments to every line
             if alignment:
-                parts = label.splitlines()
-                if label.endswith("\n"):
-                    parts.append("")
-                new_parts = []
-                for part in parts:
-                    if not part or "{...}" in part or "{measure}" in part:
-                        new_parts.append(part)
-                    else:
-                        new_parts.append(
-                            f"{part}{{...}}" if alignment == "<" else f"{{...}}{part}"
-                        )
-                label = "\n".join(new_parts)
+                label = _RE_UNALIGNED_LINE.sub(
+                    r"\1{...}" if alignment == "<" else r"{...}\1", label
+                )
 
             columns.append(label)
 
         if not column_proportions:
             column_proportions = [1]
 
-        # Calculate column widths
-        total_proportions = sum(column_proportions)
-        column_gaps_width = self.opts.column_gap * (len(columns) - 1)
-        column_widths = [
-            x * (area.X - column_gaps_width) / total_proportions
-            for x in column_proportions
-        ]
-        logger.debug(f"{column_widths=}")
-        logger.debug(f"{column_proportions=}")
+        # Calculate column widths, and the X position of each column center
+        column_gap = self.opts.column_gap
+        width_per_proportion = (area.X - column_gap * (len(columns) - 1)) / sum(
+            column_proportions
+        )
+        column_widths = [x * width_per_proportion for x in column_proportions]
+        column_centers = []
+        x = -area.X / 2
+        for width in column_widths:
+            column_centers.append(x + width / 2)
+            x += width + column_gap
+        logger.debug("column_widths=%r", column_widths)
+        logger.debug("column_proportions=%r", column_proportions)
+
+        # A single column spans the whole area and is already centered
+        if len(columns) == 1:
+            return self._do_multiline_render(
+                columns[0], Vector(X=column_widths[0], Y=area.Y)
+            )
 
         with BuildSketch(mode=Mode.PRIVATE) as sketch:
-            x = -area.X / 2
-            for column_spec, width in zip(columns, column_widths):
+            for column_spec, width, x in zip(columns, column_widths, column_centers):
                 add(
                     self._do_multiline_render(
                         column_spec, Vector(X=width, Y=area.Y)
-                    ).locate(Location((x + (width / 2), 0)))
+                    ).locate(Location((x, 0)))
                 )
-                x += width + self.opts.column_gap
 
         return sketch.sketch
-        # return self._do_multiline_render(spec, area)
 
-    def _do_multiline_render(
-        self, spec: str, area: Vector, is_rescaling: bool = False
-    ) -> Sketch:
-        """Label render function, with ability to recurse."""
-        lines = spec.splitlines()
-        if spec.endswith("\n"):
-            lines.append("")
+    def _do_multiline_render(self, spec: str, area: Vector) -> Sketch:
+        """
+        Render a multi-line label into an area.
 
-        if not lines:
+        If the first layout does not fit, the available height is scaled
+        down from the measured size. Plain single lines of text are then
+        scaled directly; anything else is laid out once more.
+        """
+        if not spec:
             raise ValueError("Asked to render empty label")
 
+        # Unlike splitlines, this keeps the empty line after a trailing \n
+        lines = spec.split("\n")
+
+        sketch = self._render_lines(lines, area)
+        size = sketch.bounding_box().size
+        logger.info(
+            'Entry "%s" calculated width = %.1f (max %s)',
+            spec.replace("\n", "\\n"),
+            size.X,
+            area.X,
+        )
+
+        # Most labels fit first time, so only work out scaling if needed
+        if size.X * 0.99 <= area.X and size.Y * 0.99 <= area.Y:
+            return sketch
+
+        scale_to_maxwidth = area.X / size.X
+        scale_to_maxheight = area.Y / size.Y
+
+        if scale_to_maxheight < 1 - 1e-3:
+            logger.debug(
+                "Vertical scale is too high for area (%s); downscaling",
+                scale_to_maxheight,
+            )
+        to_scale = min(scale_to_maxheight, scale_to_maxwidth, 1)
+        logger.debug("Got scale: %s", to_scale)
+        logger.debug("Rescaling as %s", scale_to_maxwidth)
+        # We need to scale this down. Resort to adjusting the height
+        # and laying out again. If we had an area that didn't fill the
+        # whole height, then we need to scale down THAT height, instead
+        # of the "total available" height
+        height_to_scale = min(area.Y, size.Y)
+        new_height = height_to_scale * to_scale * 0.95
+
+        if self._layout_scales_linearly(lines):
+            # Laying out again would give exactly the same geometry, scaled
+            second_try = sketch.scale(new_height / area.Y)
+        else:
+            second_try = self._render_lines(lines, Vector(X=area.X, Y=new_height))
+        # If this didn't help, then error
+        if (bbox_w := second_try.bounding_box().size.X) > area.X:
+            logger.warning(
+                'Warning: Could not fit label "%s" in box of width %.2f, got %.1f',
+                spec,
+                area.X,
+                bbox_w,
+            )
+        return second_try
+
+    def _layout_scales_linearly(self, lines: list[str]) -> bool:
+        """
+        Would laying out these lines at a different height only scale them?
+
+        This is only the case for a single line of plain text with no fixed
+        font size. Line spacing, fixed-size fragments and variable-width
+        fragments all lay out differently at different heights.
+        """
+        return (
+            len(lines) == 1
+            and not self.opts.font.font_height_mm
+            and all(
+                isinstance(x, (fragments.TextFragment, fragments.WhitespaceFragment))
+                for x in _spec_to_fragments(lines[0])
+            )
+        )
+
+    def _render_lines(self, lines: list[str], area: Vector) -> Sketch:
+        """Lay out a list of lines, evenly distributed vertically in an area."""
         row_height = (area.Y - (self.opts.line_spacing_mm * (len(lines) - 1))) / len(
             lines
         )
 
+        # Blank lines take up space, but have nothing to render
+        nonempty = [(n, line) for n, line in enumerate(lines) if line]
+        line_pitch = row_height + self.opts.line_spacing_mm
+        line_area = Vector(X=area.X, Y=row_height)
+
         with BuildSketch() as sketch:
             # Render each line onto the sketch separately
-            for n, line in enumerate(lines):
-                # Handle blank lines
-                if not line:
-                    continue
+            for n, line in nonempty:
                 # Calculate the y of the line center
-                render_y = (
-                    area.Y / 2
-                    - (row_height + self.opts.line_spacing_mm) * n
-                    - row_height / 2
-                )
-                logger.info(f'Rendering line {n+1} ("{line}")')
+                render_y = area.Y / 2 - line_pitch * n - row_height / 2
+                logger.info('Rendering line %d ("%s")', n + 1, line)
                 IndentingRichHandler.indent()
-                with Locations([(0, render_y)]):
+                # Place all of the fragments on the line with a single add
+                if placed := self._render_single_line(
+                    line, line_area, self.opts.allow_overheight
+                ):
                     add(
-                        self._render_single_line(
-                            line,
-                            Vector(X=area.X, Y=row_height),
-                            self.opts.allow_overheight,
-                        )
+                        [
+                            frag_sketch.moved(Location((x, render_y)))
+                            for x, frag_sketch in placed
+                        ]
                     )
                 IndentingRichHandler.dedent()
 
-        scale_to_maxwidth = area.X / sketch.sketch.bounding_box().size.X
-        scale_to_maxheight = area.Y / sketch.sketch.bounding_box().size.Y
+        return sketch.sketch
 
-        if scale_to_maxheight < 1 - 1e3:
-            print(
-                f"Vertical scale is too high for area ({scale_to_maxheight}); downscaling"
-            )
-        to_scale = min(scale_to_maxheight, scale_to_maxwidth, 1)
-        print(f"Got scale: {to_scale}")
-        if to_scale < 0.99 and not is_rescaling:
-            print(f"Rescaling as {scale_to_maxwidth}")
-            # We need to scale this down. Resort to adjusting the height and re-requesting.
-            # second = make_text_label(
-            #     spec,
-            #     maxwidth,
-            #     maxheight=maxheight * scale_to_maxwidth * 0.95,
-            #     _rescaling=True,
-            # )
-
-            # If we had an area that didn't fill the whole height, then we need
-            # to scale down THAT height, instead of the "total available" height
-            height_to_scale = min(area.Y, sketch.sketch.bounding_box().size.Y)
-
-            second_try = self._do_multiline_render(
-                spec,
-                Vector(X=area.X, Y=height_to_scale * to_scale * 0.95),
-                is_rescaling=True,
-            )
-            # If this didn't help, then error
-            if (bbox_w := second_try.bounding_box().size.X) > area.X:
-                logger.warning(
-                    'Warning: Could not fit label "%s" in box of width %.2f, got %.1f',
-                    spec,
-                    area.X,
-                    bbox_w,
-                )
-            print_spec = spec.replace("\n", "\\n")
-            print(
-                f'Entry "{print_spec}" calculated width = {sketch.sketch.bounding_box().size.X:.1f} (max {area.X})'
-            )
-            return second_try
-        print(
-            f'Entry "{spec}" calculated width = {sketch.sketch.bounding_box().size.X:.1f} (max {area.X})'
-        )
+    def _render_fragment(
+        self,
+        frag: fragments.Fragment,
+        height: float,
+        maxsize: float,
+        options: RenderOptions,
+    ) -> tuple[Sketch, float]:
+        """
+        Render a fragment, reusing the result of an identical previous render.
 
-        return sketch.sketch
+        Returns:
+            The rendered sketch, and its width.
+        """
+        key = (frag, height, maxsize, options)
+        cache = self._render_cache
+        if (result := cache.get(key)) is not None:
+            cache.move_to_end(key)
+            return result
+        sketch = frag.render(height, maxsize, options)
+        result = cache[key] = (sketch, sketch.bounding_box().size.X)
+        if len(cache) > _RENDER_CACHE_SIZE:
+            cache.popitem(last=False)
+        return result
 
     def _render_single_line(
         self, line: str, area: Vector, allow_overheight: bool
-    ) -> Sketch:
+    ) -> list[tuple[float, Sketch]]:
         """
         Render a single line of a labelspec.
+
+        Returns:
+            The visible fragment sketches, each paired with the X offset
+            of the fragment center from the center of the line.
         """
         # Firstly, split the line into a set of fragment objects
         frags = _spec_to_fragments(line)
+        # Lines that are only whitespace have nothing visible to render
+        if all(isinstance(x, fragments.WhitespaceFragment) for x in frags):
+            return []
 
         # Overheight fragments: Work out if we have any, so that we can
         # scale the total height such that they fit.
         # If this isn't turned on, then we will still allow the fragment
         # to be overheight but it will be given a smaller vertical area
         # such that the overheight fits in the line.
-        options = self.opts._replace(allow_overheight=allow_overheight)
+        options = self._line_options[allow_overheight]
         Y_available = area.Y
         if allow_overheight:
             max_overheight = max(x.overheight or 1 for x in frags)
             if max_overheight > 1:
                 Y_available /= max_overheight
-                print(
-                    f"Scaling Y area to account for overheight from {area.Y:.2f} -> {Y_available:.2f}"
+                logger.debug(
+                    "Scaling Y area to account for overheight from %.2f -> %.2f",
+                    area.Y,
+                    Y_available,
                 )
 
-        rendered: dict[fragments.Fragment, Sketch] = {}
-        for frag in [x for x in frags if not x.variable_width]:
+        # Partition into fixed and variable width fragments. Fragment
+        # instances can be shared between identical specs, so track them
+        # (and their rendered results) by position in the line.
+        fixed: list[tuple[int, fragments.Fragment]] = []
+        variable: list[tuple[int, fragments.Fragment]] = []
+        for item in enumerate(frags):
+            (variable if item[1].variable_width else fixed).append(item)
+
+        # Loop invariants
+        render_fragment = self._render_fragment
+        area_x = area.X
+        area_y = area.Y
+
+        # The rendered sketch, and width, of each fragment
+        rendered: dict[int, tuple[Sketch, float]] = {}
+        for i, frag in fixed:
             # Handle overheight if we have overheight turned off
-            frag_available_y = Y_available / (
-                1 if allow_overheight else (frag.overheight or 1)
+            frag_available_y = (
+                Y_available
+                if allow_overheight
+                else Y_available / (frag.overheight or 1)
             )
-            rendered[frag] = frag.render(frag_available_y, area.X, self.opts)
+            rendered[i] = render_fragment(frag, frag_available_y, area_x, self.opts)
 
         # Work out what we have left to give to the variable labels
-        remaining_area = area.X - sum(
-            x.bounding_box().size.X for x in rendered.values()
-        )
-        count_variable = len(frags) - len(rendered)
+        remaining_area = area_x - sum(width for _, width in rendered.values())
+        count_variable = len(variable)
 
-        # Render the variable-width labels.
+        # Render the variable-width labels, highest priority first.
         # For now, very dumb algorithm: Each variable fragment gets w/N.
         # but we recalculate after each render.
-        for frag in sorted(
-            [x for x in frags if x.variable_width],
-            key=lambda x: x.priority,
-            reverse=True,
-        ):
+        if len(variable) > 1:
+            variable.sort(key=lambda x: x[1].priority, reverse=True)
+        for i, frag in variable:
             # Handle overheight if we have overheight turned off
-            frag_available_y = Y_available / (
-                1 if allow_overheight else (frag.overheight or 1)
+            frag_available_y = (
+                Y_available
+                if allow_overheight
+                else Y_available / (frag.overheight or 1)
             )
-            render = frag.render(
+            rendered[i] = render_fragment(
+                frag,
                 frag_available_y,
-                max(remaining_area / count_variable, frag.min_width(area.Y)),
+                max(remaining_area / count_variable, frag.min_width(area_y)),
                 options,
             )
-            rendered[frag] = render
             count_variable -= 1
-            remaining_area -= render.bounding_box().size.X
+            remaining_area -= rendered[i][1]
 
         # Calculate the total width
-        total_width = sum(x.bounding_box().size.X for x in rendered.values())
-        if total_width > area.X:
+        total_width = sum(width for _, width in rendered.values())
+        if total_width > area_x:
             logger.warning("Overfull Hbox: Label is wider than available area")
 
-        # Assemble these onto the target
-        with BuildSketch() as sketch:
-            x = -total_width / 2
-            for fragment, frag_sketch in [(x, rendered[x]) for x in frags]:
-                fragment_width = frag_sketch.bounding_box().size.X
-                with Locations((x + fragment_width / 2, 0)):
-                    if fragment.visible:
-                        add(frag_sketch)
-                x += fragment_width
+        # Work out where each of these goes on the line
+        placed = []
+        x = -total_width / 2
+        for i, fragment in enumerate(frags):
+            frag_sketch, fragment_width = rendered[i]
+            if fragment.visible:
+                placed.append((x + fragment_width / 2, frag_sketch))
+            x += fragment_width
 
-        return sketch.sketch
+        return placed
 
 
 def render_divided_label(
-    labels: str, area: Vector, divisions: int, options: RenderOptions
+    labels: str,
+    area: Vector,
+    divisions: int,
+    options: RenderOptions,
+    renderer: LabelRenderer | None = None,
 ) -> Sketch:
     """
     Create a sketch for multiple labels fitted into a single area
+
+    A renderer can be passed in to share rendered fragments between calls.
+    It must have been created with the same options.
     """
     area = Vector(X=area.X - options.margin_mm * 2, Y=area.Y - options.margin_mm * 2)
     area_per_label = Vector(area.X / divisions, area.Y)
     leftmost_label_x = -area.X / 2 + area_per_label.X / 2
-    renderer = LabelRenderer(options)
+    renderer = renderer or LabelRenderer(options)
     with BuildSketch() as sketch:
         for i, label in enumerate(labels):
-            with Locations([(leftmost_label_x + i * area_per_label.X, 0)]):
-                if label.strip():
+            if label.strip():
+                with Locations([(leftmost_label_x + i * area_per_label.X, 0)]):
                     add(renderer.render(label, area_per_label))
 
     return sketch.sketch
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import argparse
+import atexit
 import contextlib
+import functools
 import importlib
 import importlib.resources
 import logging
@@ -21,14 +23,38 @@ class LabelStyle(Enum):
 
     @classmethod
     def _missing_(cls, value):
-        for kind in cls:
-            if kind.name.lower() == value.lower():
-                return kind
+        if isinstance(value, str):
+            return _LABEL_STYLES_BY_NAME.get(value.lower())
 
     def __str__(self):
         return self.name.lower()
 
 
+# Case-insensitive lookup of label and font styles by name
+_LABEL_STYLES_BY_NAME = {kind.name.lower(): kind for kind in LabelStyle}
+_FONT_STYLES_BY_NAME = {style.name.lower(): style for style in FontStyle}
+
+
+# Resources extracted to the filesystem (if the package is zipped) are kept
+# until exit, so that the internal font paths can be reused across renders
+_resource_stack = contextlib.ExitStack()
+atexit.register(_resource_stack.close)
+
+
+@functools.lru_cache
+def _internal_font_path(font_style: FontStyle) -> str:
+    """Get a filesystem path to the built-in OpenSans font for a style"""
+    # This is a bit noisy but the way you are supposed to do it
+    fontfile = _resource_stack.enter_context(
+        importlib.resources.as_file(
+            importlib.resources.files("gflabel").joinpath(
+                f"resources/OpenSans-{font_style.name.title()}"
+            )
+        )
+    )
+    return str(fontfile)
+
+
 class FontOptions(NamedTuple):
     font: str | None = None
     font_style: FontStyle = FontStyle.REGULAR
@@ -64,22 +90,12 @@ class FontOptions(NamedTuple):
         if self.font:
             kwargs["font"] = self.font
 
-        with contextlib.ExitStack() as stack:
-            # If we have no font, and no font path, then use the built-in ones
-            if not self.font and not self.font_path:
-                logger.debug("Falling back to internal font OpenSans")
-                # This is a bit noisy but the way you are supposed to do it
-                fontfile = stack.enter_context(
-                    importlib.resources.as_file(
-                        importlib.resources.files("gflabel").joinpath(
-                            f"resources/OpenSans-{self.font_style.name.title()}"
-                        )
-                    )
-                )
-
-                kwargs["font_path"] = str(fontfile)
+        # If we have no font, and no font path, then use the built-in ones
+        if not self.font and not self.font_path:
+            logger.debug("Falling back to internal font OpenSans")
+            kwargs["font_path"] = _internal_font_path(self.font_style)
 
-            yield kwargs
+        yield kwargs
 
 
 class RenderOptions(NamedTuple):
@@ -94,9 +110,10 @@ class RenderOptions(NamedTuple):
 
     @classmethod
     def from_args(cls, args: argparse.Namespace) -> RenderOptions:
-        font_style = [
-            x for x in FontStyle if x.name.lower() == args.font_style.lower()
-        ][0]
+        try:
+            font_style = _FONT_STYLES_BY_NAME[args.font_style.lower()]
+        except KeyError:
+            raise ValueError(f"Unknown font style: {args.font_style!r}") from None
         margin_mm = args.margin
         if isinstance(args.margin, pint.Quantity):
             if not args.margin.check("[length]"):
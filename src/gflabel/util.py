@@ -1,7 +1,9 @@
 from __future__ import annotations
 
 import logging
+import sys
 import textwrap
+import threading
 from collections.abc import Mapping
 from itertools import islice
 from typing import Any, Callable, Sequence
@@ -26,31 +28,44 @@ unit_registry.add_context(ctx)
 pint.set_application_registry(unit_registry)
 
 
-# Taken from Python 3.12 documentation.
-def batched(iterable, n):
-    # batched('ABCDEFG', 3) → ABC DEF G
-    if n < 1:
-        raise ValueError("n must be at least one")
-    it = iter(iterable)
-    while batch := tuple(islice(it, n)):
-        yield batch
+if sys.version_info >= (3, 12):
+    from itertools import batched
+else:
+    # Taken from Python 3.12 documentation.
+    def batched(iterable, n):
+        # batched('ABCDEFG', 3) → ABC DEF G
+        if n < 1:
+            raise ValueError("n must be at least one")
+        it = iter(iterable)
+        while batch := tuple(islice(it, n)):
+            yield batch
+
+
+class _IndentState(threading.local):
+    depth = 0
 
 
 class IndentingRichHandler(RichHandler):
-    _INDENT = ""
     _SINGLE_INDENT = "    "
+    # Track the indent per thread, so renders on other threads are unaffected
+    _state = _IndentState()
 
     @classmethod
     def indent(cls):
-        cls._INDENT += cls._SINGLE_INDENT
+        cls._state.depth += 1
 
     @classmethod
     def dedent(cls):
-        cls._INDENT = cls._INDENT[len(cls._SINGLE_INDENT) :]
+        cls._state.depth = max(cls._state.depth - 1, 0)
 
     def emit(self, record: logging.LogRecord) -> None:
-        if isinstance(record.msg, str):
-            record.msg = textwrap.indent(record.msg, self._INDENT)
+        if (depth := self._state.depth) and isinstance(record.msg, str):
+            indent = self._SINGLE_INDENT * depth
+            # Most messages are a single line, so don't need splitting
+            if "\n" in record.msg:
+                record.msg = textwrap.indent(record.msg, indent)
+            else:
+                record.msg = indent + record.msg
         return super().emit(record)
 
 
@@ -64,18 +79,21 @@ def format_table(
     """Very simple table formatter"""
     lines = []
     row_selector = row_selector or (lambda x: x)
-    max_lens = [
-        max(len(h), *[len(row[row_selector(h)]) for row in rows]) for h in headers
-    ]
+    keys = [row_selector(h) for h in headers]
+    # Pull out the cells for each row once, in column order
+    cells = [tuple(row[key] for key in keys) for row in rows]
+    max_lens = [len(h) for h in headers]
+    for row_cells in cells:
+        for i, cell in enumerate(row_cells):
+            if (length := len(cell)) > max_lens[i]:
+                max_lens[i] = length
     headings = [f"{h:{w}}" for h, w in zip(headers, max_lens)]
     if rich_header:
         headings = [f"[b]{x}[/b]" for x in headings]
     lines.append(prefix + " ".join(headings))
-    for row in rows:
-        lines.append(
-            prefix
-            + " ".join(
-                [f"{row[row_selector(h)]:{w}}" for h, w in zip(headers, max_lens)]
-            )
-        )
+    row_format = prefix.replace("{", "{{").replace("}", "}}") + " ".join(
+        f"{{:{w}}}" for w in max_lens
+    )
+    for row_cells in cells:
+        lines.append(row_format.format(*row_cells))
     return lines